@@ -1,265 +1,694 @@
 # 1. Stopped using Python closures and explicitly passed environments in function evaluation.
 # 2. Allowed function applications on expressions instead of just names.
 
-from dataclasses import dataclass
-from typing import Union, Dict, Any
+from dataclasses import dataclass, field, fields, is_dataclass, replace
+from typing import Union, Any, Optional, List, Callable, Tuple, ClassVar
 from lark import Tree
 import sys
 
 Literal = Union[int, bool, str]
 
-@dataclass
-class Lit:
+_UNSET = object()
+
+# Opcode of each node kind, for eval's dispatch chain. Binary operators that
+# evaluate both operands left to right are numbered OP_ADD..OP_CONCAT_STR.
+OP_NAME = 0
+OP_LIT = 1
+OP_ADD = 2
+OP_SUB = 3
+OP_LT = 4
+OP_EQ = 5
+OP_MUL = 6
+OP_CONCAT = 7
+OP_CONCAT_STR = 8
+OP_IF = 9
+OP_APP = 10
+OP_LET = 11
+OP_LETFUN = 12
+OP_SEQ = 13
+OP_BLOCK = 14
+OP_ASSIGN = 15
+OP_DIV = 16
+OP_NEG = 17
+OP_NOT = 18
+OP_AND = 19
+OP_OR = 20
+OP_AND_BOOL = 21
+OP_OR_BOOL = 22
+OP_REPLACE = 23
+OP_REPLACE_LIT = 24
+OP_REVERSE_STR = 25
+OP_LENGTH_STR = 26
+OP_SHOW = 27
+OP_READ = 28
+OP_PURE = 29     # a pure node: check its cached value first, then run its opcode
+OP_UNKNOWN = 30  # a Node subclass eval does not know, e.g. a resolver slot node
+
+@dataclass(slots=True, frozen=True)
+class Node:
+    # pure is set on subtrees built only from literals and side-effect-free
+    # operators; eval caches their value on the node the first time.
+    pure: bool = field(init=False, repr=False, compare=False)
+    _cached_value: Any = field(init=False, default=_UNSET, repr=False, compare=False)
+    # What eval dispatches on: the class's opcode, or OP_PURE for a pure node,
+    # so nodes that can never be cached skip the cache check entirely.
+    op: int = field(init=False, repr=False, compare=False)
+    opcode: ClassVar[int] = OP_UNKNOWN
+
+    def __post_init__(self):
+        # Nodes are frozen; derived flags are filled in once, here.
+        pure = type(self) in _PURE_NODES and _constant_operands(self)
+        object.__setattr__(self, 'pure', pure)
+        object.__setattr__(self, 'op', OP_PURE if pure else self.opcode)
+
+@dataclass(slots=True, frozen=True)
+class Lit(Node):
+    opcode = OP_LIT
     value: Literal
 
-@dataclass
-class Add:
+@dataclass(slots=True, frozen=True)
+class Add(Node):
+    opcode = OP_ADD
     left: 'Expr'
     right: 'Expr'
 
-@dataclass
-class Sub:
+@dataclass(slots=True, frozen=True)
+class Sub(Node):
+    opcode = OP_SUB
     left: 'Expr'
     right: 'Expr'
 
-@dataclass
-class Mul:
+@dataclass(slots=True, frozen=True)
+class Mul(Node):
+    opcode = OP_MUL
     left: 'Expr'
     right: 'Expr'
 
-@dataclass
-class Div:
+@dataclass(slots=True, frozen=True)
+class Div(Node):
+    opcode = OP_DIV
     left: 'Expr'
     right: 'Expr'
 
-@dataclass
-class Neg:
+@dataclass(slots=True, frozen=True)
+class Neg(Node):
+    opcode = OP_NEG
     expr: 'Expr'
 
-@dataclass
-class And:
+@dataclass(slots=True, frozen=True)
+class And(Node):
+    opcode = OP_AND
     left: 'Expr'
     right: 'Expr'
 
-@dataclass
-class Or:
+@dataclass(slots=True, frozen=True)
+class Or(Node):
+    opcode = OP_OR
     left: 'Expr'
     right: 'Expr'
 
-@dataclass
-class Not:
+@dataclass(slots=True, frozen=True)
+class Not(Node):
+    opcode = OP_NOT
     expr: 'Expr'
 
-@dataclass
-class Let:
+@dataclass(slots=True, frozen=True)
+class Let(Node):
+    opcode = OP_LET
     name: str
     value_expr: 'Expr'
     body: 'Expr'
+    escapes: bool = field(init=False, repr=False, compare=False)
 
-@dataclass
-class Name:
+    def __post_init__(self):
+        Node.__post_init__(self)
+        object.__setattr__(self, 'escapes', _may_escape(self.body))
+
+@dataclass(slots=True, frozen=True)
+class Name(Node):
+    opcode = OP_NAME
     name: str
 
-@dataclass
-class Eq:
+@dataclass(slots=True, frozen=True)
+class Eq(Node):
+    opcode = OP_EQ
     left: 'Expr'
     right: 'Expr'
 
-@dataclass
-class Lt:
+@dataclass(slots=True, frozen=True)
+class Lt(Node):
+    opcode = OP_LT
     left: 'Expr'
     right: 'Expr'
 
-@dataclass
-class If:
+@dataclass(slots=True, frozen=True)
+class If(Node):
+    opcode = OP_IF
     cond: 'Expr'
     then: 'Expr'
     else_: 'Expr'
 
-@dataclass
-class Concat:
+@dataclass(slots=True, frozen=True)
+class Concat(Node):
+    opcode = OP_CONCAT
     left: 'Expr'
     right: 'Expr'
 
-@dataclass
-class Replace:
+@dataclass(slots=True, frozen=True)
+class Replace(Node):
+    opcode = OP_REPLACE
     string: 'Expr'
     target: 'Expr'
     replacement: 'Expr'
 
-@dataclass
-class Letfun:
+@dataclass(slots=True, frozen=True)
+class Letfun(Node):
+    opcode = OP_LETFUN
     name: str
     param: str
     body: 'Expr'
     in_expr: 'Expr'
+    escapes: bool = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        Node.__post_init__(self)
+        object.__setattr__(self, 'escapes', _may_escape(self.body))
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class FunDef:
     param: str
     body: 'Expr'
-    env: Dict[str, Any]
+    env: 'Frame' = field(repr=False)
+    escapes: bool = field(default=True, repr=False, compare=False)
 
-@dataclass
-class App:
+@dataclass(slots=True, frozen=True)
+class App(Node):
+    opcode = OP_APP
     fun_expr: 'Expr'
     arg_expr: 'Expr'
 
-@dataclass
-class Assign:
+@dataclass(slots=True, frozen=True)
+class Assign(Node):
+    opcode = OP_ASSIGN
     name: str
     value_expr: 'Expr'
 
-@dataclass
-class Seq:
+@dataclass(slots=True, frozen=True)
+class Seq(Node):
+    opcode = OP_SEQ
     first: 'Expr'
     second: 'Expr'
 
-@dataclass
-class ReverseStr:
+@dataclass(slots=True, frozen=True)
+class Block(Node):
+    # A flattened `e1; e2; ...; en` chain; its value is that of the last expression.
+    opcode = OP_BLOCK
+    exprs: Tuple['Expr', ...]
+
+@dataclass(slots=True, frozen=True)
+class ReverseStr(Node):
+    opcode = OP_REVERSE_STR
     string_expr: 'Expr'
 
-@dataclass
-class LengthStr:
+@dataclass(slots=True, frozen=True)
+class LengthStr(Node):
+    opcode = OP_LENGTH_STR
     string_expr: 'Expr'
 
-@dataclass
-class Show:
+@dataclass(slots=True, frozen=True)
+class Show(Node):
+    opcode = OP_SHOW
     expr: 'Expr'
 
-@dataclass
-class Read:
-    pass
+@dataclass(slots=True, frozen=True)
+class Read(Node):
+    opcode = OP_READ
+
+# Specialized forms produced by optimize.specialize() once the operand types
+# are known, so eval can skip the runtime type checks.
+@dataclass(slots=True, frozen=True)
+class AndBool(Node):
+    opcode = OP_AND_BOOL
+    left: 'Expr'
+    right: 'Expr'
 
-Expr = Union[Lit, Add, Sub, Mul, Div, Neg, And, Or, Not, Let, Name, Eq, Lt, If, Concat, Replace, Letfun, App, Assign, Seq, Show, Read]
-Env = Dict[str, Any]
+@dataclass(slots=True, frozen=True)
+class OrBool(Node):
+    opcode = OP_OR_BOOL
+    left: 'Expr'
+    right: 'Expr'
 
-def eval(expr: Expr, env: Env = None, store: Dict[str, Any] = None) -> Any:
-    if env is None:
-        env = {}
-    if store is None:
-        store = {}
+@dataclass(slots=True, frozen=True)
+class ConcatStr(Node):
+    opcode = OP_CONCAT_STR
+    left: 'Expr'
+    right: 'Expr'
 
+@dataclass(slots=True, frozen=True)
+class ReplaceLit(Node):
+    opcode = OP_REPLACE_LIT
+    string: 'Expr'
+    target: str
+    replacement: str
+
+def _is_node_tuple(value: Any) -> bool:
+    return isinstance(value, tuple) and all(is_dataclass(v) for v in value)
+
+def children(expr: 'Expr') -> List['Expr']:
+    if not is_dataclass(expr):
+        return []  # e.g. an unresolved lark `_ambig` Tree; eval reports it
+    result = []
+    for f in fields(expr):
+        if f.init:
+            value = getattr(expr, f.name)
+            if is_dataclass(value):
+                result.append(value)
+            elif _is_node_tuple(value):
+                result.extend(value)
+    return result
+
+def map_children(expr: 'Expr', fn: Callable[['Expr'], 'Expr']) -> 'Expr':
+    """Rebuild `expr` with `fn` applied to each child; unchanged nodes are returned as is."""
+    if not is_dataclass(expr):
+        return expr
+    changes = {}
+    for f in fields(expr):
+        if not f.init:
+            continue
+        value = getattr(expr, f.name)
+        if is_dataclass(value):
+            new = fn(value)
+            if new is not value:
+                changes[f.name] = new
+        elif _is_node_tuple(value):
+            new = tuple(fn(v) for v in value)
+            if any(n is not v for n, v in zip(new, value)):
+                changes[f.name] = new
+    return replace(expr, **changes) if changes else expr
+
+def _may_escape(expr: 'Expr') -> bool:
+    # A frame can only outlive its scope if a closure captures it, and only
+    # Letfun builds closures. Nested Let/Letfun nodes already carry the answer.
     match expr:
-        case Lit(value):
-            return value
-
-        case Name(name):
-            if name in env:
-                return env[name]
-            raise NameError(f"Undefined variable: {name}")
-
-        case Let(name, value_expr, body):
-            new_env = env.copy()
-            new_env[name] = eval(value_expr, new_env)
-            return eval(body, new_env)
-
-        case Add(left, right):
-            return eval(left, env) + eval(right, env)
-
-        case Sub(left, right):
-            return eval(left, env) - eval(right, env)
-
-        case Mul(left, right):
-            return eval(left, env) * eval(right, env)
-
-        case Div(left, right):
-            right_val = eval(right, env)
-            if right_val == 0:
-                raise ZeroDivisionError("Division by zero")
-            return eval(left, env) // right_val
-
-        case Neg(expr):
-            return -eval(expr, env)
-
-        case And(left, right):
-            left_val = eval(left, env)
-            right_val = eval(right, env)
-            if not isinstance(left_val, bool) or not isinstance(right_val, bool):
-                raise TypeError("Operands of '&&' must be boolean")
-            return eval(left, env) and eval(right, env)
-
-        case Or(left, right):
-            left_val = eval(left, env)
-            right_val = eval(right, env)
-            if not isinstance(left_val, bool) or not isinstance(right_val, bool):
-                raise TypeError("Operands of '||' must be boolean")
-            return eval(left, env) or eval(right, env)
-
-        case Not(expr):
-            return not eval(expr, env)
-
-        case Eq(left, right):
-            return eval(left, env) == eval(right, env)
-
-        case Lt(left, right):
-            return eval(left, env) < eval(right, env)
-
-        case If(cond, then, else_):
-            return eval(then, env) if eval(cond, env) else eval(else_, env)
-
-        case Concat(left, right):
-            left_val, right_val = eval(left, env), eval(right, env)
-            if isinstance(left_val, str) and isinstance(right_val, str):
-                return left_val + right_val
-            raise TypeError("Concatenation requires string operands")
-
-        case Replace(string, target, replacement):
-            str_val, target_val, replacement_val = eval(string, env), eval(target, env), eval(replacement, env)
-            if isinstance(str_val, str) and isinstance(target_val, str) and isinstance(replacement_val, str):
-                return str_val.replace(target_val, replacement_val)
-            raise TypeError("Replace requires string operands")
-
-        case ReverseStr(string_expr):
-            str_val = eval(string_expr, env)
-            if isinstance(str_val, str):
-                return str_val[::-1]
-            raise TypeError("Reverse requires a string operand")
-
-        case LengthStr(string_expr):
-            str_val = eval(string_expr, env)
-            if isinstance(str_val, str):
-                return len(str_val)
-            raise TypeError("Length requires a string operand")
-
-        case Letfun(name, param, body, in_expr):
-            new_env = env.copy()
-            new_env[name] = FunDef(param, body, new_env)            
-            return eval(in_expr, new_env)
-
-        case App(fun_expr, arg_expr):
-            func = eval(fun_expr, env)
-            if not isinstance(func, FunDef):
-                raise TypeError(f"'{func}' is not a function")
-            arg = eval(arg_expr, env)
-            new_env = func.env.copy()
-            new_env[func.param] = arg
-            return eval(func.body, new_env)
-
-        case Assign(name, value_expr):
-            if name not in env:
-                raise NameError(f"Variable '{name}' is not defined")
-            env[name] = eval(value_expr, env)
-            return env[name]
-
-        case Seq(first, second):
-            eval(first, env)
-            return eval(second, env)
-
-        case Show(expr):
-            result = eval(expr, env)
-            print(result)
-            return result
-
-        case Read():
-            user_input = input().strip()
-            try:
-                return int(user_input)
-            except ValueError:
-                raise ValueError("Invalid input, expected an integer")
-
+        case Letfun():
+            return True
+        case Let(_, value_expr, _):
+            return expr.escapes or _may_escape(value_expr)
         case _:
-            raise TypeError(f"Unknown expression type: {expr}")
+            return any(_may_escape(child) for child in children(expr))
+
+def _constant_operands(expr: 'Expr') -> bool:
+    # Every operand is a literal or a pure node. Plain strings are ReplaceLit's
+    # literal operands; anything else, e.g. a lark `_ambig` Tree, is not constant.
+    for f in fields(expr):
+        if f.init:
+            value = getattr(expr, f.name)
+            if isinstance(value, Node):
+                if not (isinstance(value, Lit) or value.pure):
+                    return False
+            elif not isinstance(value, str):
+                return False
+    return True
+
+_PURE_NODES = {Add, Sub, Mul, Div, Neg, And, Or, Not, Eq, Lt, If, Concat, Replace, ReverseStr, LengthStr, AndBool, OrBool, ConcatStr, ReplaceLit}
+
+Expr = Union[Lit, Add, Sub, Mul, Div, Neg, And, Or, Not, Let, Name, Eq, Lt, If, Concat, Replace, Letfun, App, Assign, Seq, Show, Read, AndBool, OrBool, ConcatStr, ReplaceLit, Block]
+_MISSING = object()
+
+class Frame:
+    # A single binding plus a link to the enclosing scope. Every Let, Letfun
+    # and call binds exactly one name, so a frame needs no dict: extending an
+    # environment allocates one small object and copies nothing.
+    __slots__ = ('name', 'value', 'parent')
+
+    def __init__(self, name: Optional[str], value: Any, parent: Optional['Frame'] = None):
+        self.name = name
+        self.value = value
+        self.parent = parent
+
+    def lookup(self, name: str) -> Any:
+        f = self
+        while f is not None:
+            if f.name == name:
+                return f.value
+            f = f.parent
+        return _MISSING
+
+    def find(self, name: str) -> Optional['Frame']:
+        f = self
+        while f is not None:
+            if f.name == name:
+                return f
+            f = f.parent
+        return None
+
+Env = Frame
+
+# The empty environment. It binds no name, so lookups fall through it and
+# Assign never writes to it, which makes one shared instance safe.
+_ROOT = Frame(None, None)
+
+# Frames whose scope cannot be captured are recycled instead of reallocated.
+_FRAME_POOL: List[Frame] = []
+
+def acquire_frame(parent: Optional[Frame], name: str, value: Any) -> Frame:
+    if _FRAME_POOL:
+        frame = _FRAME_POOL.pop()
+        frame.name = name
+        frame.value = value
+        frame.parent = parent
+        return frame
+    return Frame(name, value, parent)
+
+def release_frame(frame: Frame):
+    frame.value = None
+    frame.parent = None
+    _FRAME_POOL.append(frame)
+
+# eval runs on two explicit stacks instead of the Python call stack:
+# `work` holds (step, node, env) items and `values` holds results. A step of
+# None means "evaluate node"; any other step is a continuation that consumes
+# results from `values`, e.g. _k_add pops two operands and pushes their sum.
+Work = List[tuple]
+
+def _k_let(node: Let, env: Env, work: Work, values: list):
+    value = values.pop()
+    if node.escapes:
+        work.append((None, node.body, Frame(node.name, value, env)))
+        return
+    frame = acquire_frame(env, node.name, value)
+    work.append((_k_release, frame, None))
+    work.append((None, node.body, frame))
+
+def _k_release(frame: Frame, env: Env, work: Work, values: list):
+    release_frame(frame)
+
+def _k_add(node, env: Env, work: Work, values: list):
+    right = values.pop()
+    values[-1] = values[-1] + right
+
+def _k_sub(node, env: Env, work: Work, values: list):
+    right = values.pop()
+    values[-1] = values[-1] - right
+
+def _k_mul(node, env: Env, work: Work, values: list):
+    right = values.pop()
+    values[-1] = values[-1] * right
+
+def _step_div(node: Div, env: Env, work: Work, values: list):
+    # The divisor is evaluated, and checked, before the dividend.
+    work.append((_k_div_check, node, env))
+    work.append((None, node.right, env))
+
+def _k_div_check(node: Div, env: Env, work: Work, values: list):
+    if values[-1] == 0:
+        raise ZeroDivisionError("Division by zero")
+    work.append((_k_div, None, None))
+    work.append((None, node.left, env))
+
+def _k_div(node, env: Env, work: Work, values: list):
+    left = values.pop()
+    values[-1] = left // values[-1]
+
+def _step_neg(node: Neg, env: Env, work: Work, values: list):
+    work.append((_k_neg, None, None))
+    work.append((None, node.expr, env))
+
+def _k_neg(node, env: Env, work: Work, values: list):
+    values[-1] = -values[-1]
+
+def _step_and(node: And, env: Env, work: Work, values: list):
+    work.append((_k_and, node, env))
+    work.append((None, node.left, env))
+
+def _k_and(node: And, env: Env, work: Work, values: list):
+    if not isinstance(values[-1], bool):
+        raise TypeError("Operands of '&&' must be boolean")
+    if values[-1]:
+        values.pop()
+        work.append((_k_check_and, None, None))
+        work.append((None, node.right, env))
+
+def _k_check_and(node, env: Env, work: Work, values: list):
+    if not isinstance(values[-1], bool):
+        raise TypeError("Operands of '&&' must be boolean")
+
+def _step_or(node: Or, env: Env, work: Work, values: list):
+    work.append((_k_or, node, env))
+    work.append((None, node.left, env))
+
+def _k_or(node: Or, env: Env, work: Work, values: list):
+    if not isinstance(values[-1], bool):
+        raise TypeError("Operands of '||' must be boolean")
+    if not values[-1]:
+        values.pop()
+        work.append((_k_check_or, None, None))
+        work.append((None, node.right, env))
+
+def _k_check_or(node, env: Env, work: Work, values: list):
+    if not isinstance(values[-1], bool):
+        raise TypeError("Operands of '||' must be boolean")
+
+def _step_and_bool(node: AndBool, env: Env, work: Work, values: list):
+    work.append((_k_and_bool, node, env))
+    work.append((None, node.left, env))
+
+def _k_and_bool(node: AndBool, env: Env, work: Work, values: list):
+    if values[-1]:
+        values.pop()
+        work.append((None, node.right, env))
+
+def _step_or_bool(node: OrBool, env: Env, work: Work, values: list):
+    work.append((_k_or_bool, node, env))
+    work.append((None, node.left, env))
+
+def _k_or_bool(node: OrBool, env: Env, work: Work, values: list):
+    if not values[-1]:
+        values.pop()
+        work.append((None, node.right, env))
+
+def _step_not(node: Not, env: Env, work: Work, values: list):
+    work.append((_k_not, None, None))
+    work.append((None, node.expr, env))
+
+def _k_not(node, env: Env, work: Work, values: list):
+    values[-1] = not values[-1]
+
+def _k_eq(node, env: Env, work: Work, values: list):
+    right = values.pop()
+    values[-1] = values[-1] == right
+
+def _k_lt(node, env: Env, work: Work, values: list):
+    right = values.pop()
+    values[-1] = values[-1] < right
+
+def _k_if(node: If, env: Env, work: Work, values: list):
+    work.append((None, node.then if values.pop() else node.else_, env))
+
+def _k_concat(node, env: Env, work: Work, values: list):
+    right = values.pop()
+    left = values[-1]
+    if not (isinstance(left, str) and isinstance(right, str)):
+        raise TypeError("Concatenation requires string operands")
+    values[-1] = left + right
+
+def _k_concat_str(node, env: Env, work: Work, values: list):
+    right = values.pop()
+    values[-1] = values[-1] + right
+
+def _step_replace(node: Replace, env: Env, work: Work, values: list):
+    work.append((_k_replace, None, None))
+    work.append((None, node.replacement, env))
+    work.append((None, node.target, env))
+    work.append((None, node.string, env))
+
+def _k_replace(node, env: Env, work: Work, values: list):
+    replacement_val = values.pop()
+    target_val = values.pop()
+    str_val = values[-1]
+    if not (isinstance(str_val, str) and isinstance(target_val, str) and isinstance(replacement_val, str)):
+        raise TypeError("Replace requires string operands")
+    values[-1] = str_val.replace(target_val, replacement_val)
+
+def _step_replace_lit(node: ReplaceLit, env: Env, work: Work, values: list):
+    work.append((_k_replace_lit, node, None))
+    work.append((None, node.string, env))
+
+def _k_replace_lit(node: ReplaceLit, env: Env, work: Work, values: list):
+    if not isinstance(values[-1], str):
+        raise TypeError("Replace requires string operands")
+    values[-1] = values[-1].replace(node.target, node.replacement)
+
+def _step_reverse_str(node: ReverseStr, env: Env, work: Work, values: list):
+    work.append((_k_reverse_str, None, None))
+    work.append((None, node.string_expr, env))
+
+def _k_reverse_str(node, env: Env, work: Work, values: list):
+    if not isinstance(values[-1], str):
+        raise TypeError("Reverse requires a string operand")
+    values[-1] = values[-1][::-1]
+
+def _step_length_str(node: LengthStr, env: Env, work: Work, values: list):
+    work.append((_k_length_str, None, None))
+    work.append((None, node.string_expr, env))
+
+def _k_length_str(node, env: Env, work: Work, values: list):
+    if not isinstance(values[-1], str):
+        raise TypeError("Length requires a string operand")
+    values[-1] = len(values[-1])
+
+def _step_letfun(node: Letfun, env: Env, work: Work, values: list):
+    new_env = Frame(node.name, None, env)
+    new_env.value = FunDef(node.param, node.body, new_env, node.escapes)
+    work.append((None, node.in_expr, new_env))
+
+def _k_app_fun(node: App, env: Env, work: Work, values: list):
+    func = values[-1]
+    if not isinstance(func, FunDef):
+        raise TypeError(f"'{func}' is not a function")
+    work.append((_k_call, None, None))
+    work.append((None, node.arg_expr, env))
+
+def _k_call(node, env: Env, work: Work, values: list):
+    arg = values.pop()
+    func = values.pop()
+    # A tail call: the caller's frames would be released as soon as this call
+    # returns and nothing can still read them, so release them now. Tail
+    # recursion then runs with a work stack of constant depth.
+    while work and work[-1][0] is _k_release:
+        release_frame(work.pop()[1])
+    if func.escapes:
+        work.append((None, func.body, Frame(func.param, arg, func.env)))
+        return
+    frame = acquire_frame(func.env, func.param, arg)
+    work.append((_k_release, frame, None))
+    work.append((None, func.body, frame))
+
+def _step_assign(node: Assign, env: Env, work: Work, values: list):
+    frame = env.find(node.name)
+    if frame is None:
+        raise NameError(f"Variable '{node.name}' is not defined")
+    work.append((_k_assign, node, frame))
+    work.append((None, node.value_expr, env))
+
+def _k_assign(node: Assign, frame: Frame, work: Work, values: list):
+    frame.value = values[-1]
+
+def _step_seq(node: Seq, env: Env, work: Work, values: list):
+    work.append((None, node.second, env))
+    work.append((_k_pop, None, None))
+    work.append((None, node.first, env))
+
+def _k_pop(node, env: Env, work: Work, values: list):
+    values.pop()
+
+def _step_block(node: Block, env: Env, work: Work, values: list):
+    exprs = node.exprs
+    work.append((None, exprs[-1], env))
+    for e in reversed(exprs[:-1]):
+        work.append((_k_pop, None, None))
+        work.append((None, e, env))
+
+def _step_show(node: Show, env: Env, work: Work, values: list):
+    work.append((_k_show, None, None))
+    work.append((None, node.expr, env))
+
+def _k_show(node, env: Env, work: Work, values: list):
+    print(values[-1])
+
+def _step_read(node: Read, env: Env, work: Work, values: list):
+    user_input = input().strip()
+    try:
+        values.append(int(user_input))
+    except ValueError:
+        raise ValueError("Invalid input, expected an integer")
+
+def _k_cache(node, env: Env, work: Work, values: list):
+    object.__setattr__(node, '_cached_value', values[-1])
+
+# Continuations of the OP_ADD..OP_CONCAT_STR operators, indexed by op - OP_ADD.
+_BINOP_K = (_k_add, _k_sub, _k_lt, _k_eq, _k_mul, _k_concat, _k_concat_str)
+
+def eval(expr: Expr, env: Env = _ROOT) -> Any:
+    work: Work = [(None, expr, env)]
+    values: list = []
+    push = work.append
+    pop = work.pop
+    while work:
+        step, node, env = pop()
+        if step is not None:
+            step(node, env, work, values)
+            continue
+        try:
+            op = node.op
+        except AttributeError:
+            raise TypeError(f"Unknown expression type: {node}") from None
+        # Branches are ordered by how often each kind of node is evaluated.
+        if op == OP_NAME:
+            value = env.lookup(node.name)
+            if value is _MISSING:
+                raise NameError(f"Undefined variable: {node.name}")
+            values.append(value)
+            continue
+        if op == OP_LIT:
+            values.append(node.value)
+            continue
+        if op == OP_PURE:
+            if node._cached_value is not _UNSET:
+                values.append(node._cached_value)
+                continue
+            push((_k_cache, node, None))
+            op = node.opcode
+        if op <= OP_CONCAT_STR:
+            push((_BINOP_K[op - OP_ADD], None, None))
+            push((None, node.right, env))
+            push((None, node.left, env))
+        elif op == OP_IF:
+            push((_k_if, node, env))
+            push((None, node.cond, env))
+        elif op == OP_APP:
+            push((_k_app_fun, node, env))
+            push((None, node.fun_expr, env))
+        elif op == OP_LET:
+            push((_k_let, node, env))
+            push((None, node.value_expr, env))
+        elif op == OP_LETFUN:
+            _step_letfun(node, env, work, values)
+        elif op == OP_SEQ:
+            _step_seq(node, env, work, values)
+        elif op == OP_BLOCK:
+            _step_block(node, env, work, values)
+        elif op == OP_ASSIGN:
+            _step_assign(node, env, work, values)
+        elif op == OP_DIV:
+            _step_div(node, env, work, values)
+        elif op == OP_NEG:
+            _step_neg(node, env, work, values)
+        elif op == OP_NOT:
+            _step_not(node, env, work, values)
+        elif op == OP_AND:
+            _step_and(node, env, work, values)
+        elif op == OP_OR:
+            _step_or(node, env, work, values)
+        elif op == OP_AND_BOOL:
+            _step_and_bool(node, env, work, values)
+        elif op == OP_OR_BOOL:
+            _step_or_bool(node, env, work, values)
+        elif op == OP_REPLACE:
+            _step_replace(node, env, work, values)
+        elif op == OP_REPLACE_LIT:
+            _step_replace_lit(node, env, work, values)
+        elif op == OP_REVERSE_STR:
+            _step_reverse_str(node, env, work, values)
+        elif op == OP_LENGTH_STR:
+            _step_length_str(node, env, work, values)
+        elif op == OP_SHOW:
+            _step_show(node, env, work, values)
+        elif op == OP_READ:
+            _step_read(node, env, work, values)
+        else:
+            raise TypeError(f"Unknown expression type: {node}")
+    return values.pop()
 
 if __name__ == "__main__":
     print(eval(Concat(Lit("hello"), Lit(" world"))))  # Expected: "hello world"
@@ -0,0 +1,312 @@
+# AST-to-AST optimization passes, run once after parsing.
+# 1. infer_types() computes the type an expression has whenever it evaluates without error.
+# 2. specialize() rewrites operators whose operand types are known so eval can skip their runtime checks,
+#    and replace() calls with literal target and replacement into ReplaceLit.
+# 3. fold() evaluates operators over literals once, at compile time, and drops branches that cannot run.
+# 4. hoist_invariants() moves work that does not depend on a function's argument out of its body.
+
+from dataclasses import fields, replace
+from enum import Enum
+from itertools import count
+from typing import Callable, Dict, List, Set, Tuple
+from interp import *
+
+class Ty(Enum):
+    INT = 'int'
+    BOOL = 'bool'
+    STR = 'str'
+    ANY = 'any'
+
+TyEnv = Dict[str, Ty]
+
+def _lit_type(value: Literal) -> Ty:
+    # bool is checked first: True is also an int to Python.
+    if isinstance(value, bool):
+        return Ty.BOOL
+    if isinstance(value, int):
+        return Ty.INT
+    if isinstance(value, str):
+        return Ty.STR
+    return Ty.ANY
+
+def assigned_names(expr: Expr) -> Set[str]:
+    """Names targeted by an Assign anywhere in `expr`; their types can change at runtime."""
+    names = set()
+    if isinstance(expr, Assign):
+        names.add(str(expr.name))
+    for child in children(expr):
+        names |= assigned_names(child)
+    return names
+
+def _rebuild(expr: Expr, new_children: Dict[str, Expr]) -> Expr:
+    changed = {k: v for k, v in new_children.items() if v is not getattr(expr, k)}
+    return replace(expr, **changed) if changed else expr
+
+def _has_opaque_operand(expr: Expr) -> bool:
+    """True if `expr`, or one of its operands, is neither a node nor literal data.
+
+    That is what an unresolved lark `_ambig` Tree looks like to the optimizer.
+    """
+    if not isinstance(expr, Node):
+        return True
+    for f in fields(expr):
+        if f.init:
+            value = getattr(expr, f.name)
+            if any(not isinstance(v, (Node, str, int)) for v in (value if isinstance(value, tuple) else (value,))):
+                return True
+    return False
+
+def _specialize(expr: Expr, tenv: TyEnv, assigned: Set[str]) -> Tuple[Expr, Ty]:
+    match expr:
+        case Lit(value):
+            return expr, _lit_type(value)
+
+        case Name(name):
+            return expr, tenv.get(name, Ty.ANY)
+
+        case Let(name, value_expr, body):
+            value, value_ty = _specialize(value_expr, tenv, assigned)
+            body_tenv = {**tenv, name: Ty.ANY if name in assigned else value_ty}
+            body, body_ty = _specialize(body, body_tenv, assigned)
+            return _rebuild(expr, {'value_expr': value, 'body': body}), body_ty
+
+        case Letfun(name, param, body, in_expr):
+            fun_body, _ = _specialize(body, {**tenv, name: Ty.ANY, param: Ty.ANY}, assigned)
+            in_, in_ty = _specialize(in_expr, {**tenv, name: Ty.ANY}, assigned)
+            return _rebuild(expr, {'body': fun_body, 'in_expr': in_}), in_ty
+
+        case And(left, right) | Or(left, right):
+            l, l_ty = _specialize(left, tenv, assigned)
+            r, r_ty = _specialize(right, tenv, assigned)
+            if l_ty is Ty.BOOL and r_ty is Ty.BOOL:
+                return (AndBool if isinstance(expr, And) else OrBool)(l, r), Ty.BOOL
+            return _rebuild(expr, {'left': l, 'right': r}), Ty.BOOL
+
+        case Concat(left, right):
+            l, l_ty = _specialize(left, tenv, assigned)
+            r, r_ty = _specialize(right, tenv, assigned)
+            if l_ty is Ty.STR and r_ty is Ty.STR:
+                return ConcatStr(l, r), Ty.STR
+            return _rebuild(expr, {'left': l, 'right': r}), Ty.STR
+
+        case Replace(string, Lit(str() as target), Lit(str() as replacement)):
+            s, _ = _specialize(string, tenv, assigned)
+            return ReplaceLit(s, target, replacement), Ty.STR
+
+    tys = []
+    def visit(child: Expr) -> Expr:
+        new, ty = _specialize(child, tenv, assigned)
+        tys.append(ty)
+        return new
+    new = map_children(expr, visit)
+    # An opaque operand has no type, and would leave tys out of step with the operands.
+    return new, Ty.ANY if _has_opaque_operand(expr) else _result_type(expr, tys)
+
+def _result_type(expr: Expr, tys: list) -> Ty:
+    match expr:
+        case Add() | Sub() | Mul() | Div():
+            if tys == [Ty.INT, Ty.INT]:
+                return Ty.INT
+            if isinstance(expr, Add) and tys == [Ty.STR, Ty.STR]:
+                return Ty.STR
+            return Ty.ANY
+        case Neg():
+            return Ty.INT if tys == [Ty.INT] else Ty.ANY
+        case Not() | Eq() | Lt() | AndBool() | OrBool():
+            return Ty.BOOL
+        case If():
+            return tys[1] if tys[1] is tys[2] else Ty.ANY
+        case ConcatStr() | Replace() | ReplaceLit() | ReverseStr():
+            return Ty.STR
+        case LengthStr() | Read():
+            return Ty.INT
+        case Assign() | Show():
+            return tys[0]
+        case Seq() | Block():
+            return tys[-1]
+        case _:
+            return Ty.ANY
+
+def infer_types(expr: Expr, tenv: TyEnv = None) -> Ty:
+    return _specialize(expr, tenv or {}, assigned_names(expr))[1]
+
+def specialize(expr: Expr) -> Expr:
+    return _specialize(expr, {}, assigned_names(expr))[0]
+
+def fold(expr: Expr) -> Expr:
+    match expr:
+        case If(cond, then, else_):
+            cond = fold(cond)
+            if isinstance(cond, Lit):
+                # Only the taken branch could ever run, so the other one is
+                # not folded (evaluated) either.
+                return fold(then if cond.value else else_)
+            expr = _rebuild(expr, {'cond': cond, 'then': fold(then), 'else_': fold(else_)})
+        case _:
+            expr = map_children(expr, fold)
+    match expr:
+        case Not(Not(inner)) if infer_types(inner) is Ty.BOOL:
+            # Not coerces to bool, so !!x is x only when x is already a bool.
+            return inner
+    # pure holds exactly when this is a side-effect-free operator whose
+    # children are now all literals, e.g. Concat(Lit("a"), Lit("b")).
+    if isinstance(expr, Node) and expr.pure:
+        try:
+            return Lit(eval(expr))
+        except Exception:
+            # 1 / 0 and friends keep failing at runtime, where they would have.
+            return expr
+    return expr
+
+def _safe_type(expr: Expr, tys: List[Ty], tenv: TyEnv) -> Ty:
+    """Type of `expr` if it can neither raise nor have side effects, else ANY.
+
+    `tys` are the safe types of its children. Names are safe only if `tenv`
+    types them, i.e. they are bound outside the function and never assigned.
+    """
+    match expr:
+        case Lit(value):
+            return _lit_type(value)
+        case Name(name):
+            return tenv.get(name, Ty.ANY)
+        case Add() if tys == [Ty.STR, Ty.STR]:
+            return Ty.STR
+        case Add() | Sub() | Mul() if tys == [Ty.INT, Ty.INT]:
+            return Ty.INT
+        case Neg() if tys == [Ty.INT]:
+            return Ty.INT
+        case Lt() if tys in ([Ty.INT, Ty.INT], [Ty.STR, Ty.STR]):
+            return Ty.BOOL
+        case Not() | Eq() if Ty.ANY not in tys:
+            return Ty.BOOL
+        case And() | Or() | AndBool() | OrBool() if tys == [Ty.BOOL, Ty.BOOL]:
+            return Ty.BOOL
+        case If() if Ty.ANY not in tys and tys[1] is tys[2]:
+            return tys[1]
+        case Concat() | ConcatStr() | Replace() | ReplaceLit() | ReverseStr() if all(t is Ty.STR for t in tys):
+            return Ty.STR
+        case LengthStr() if tys == [Ty.STR]:
+            return Ty.INT
+        case _:
+            return Ty.ANY
+
+# Hoisted temporaries are named %inv0, %inv1, ...; '%' cannot appear in a
+# source identifier, so they never shadow user names and are never assigned.
+_TEMP_PREFIX = '%inv'
+
+def _shape(expr: Expr) -> tuple:
+    """Structural key for `expr`; unlike ==, it tells Lit(1) from Lit(True)."""
+    if isinstance(expr, Lit):
+        return (Lit, type(expr.value), expr.value)
+    return (type(expr),) + tuple(_shape(v) if isinstance(v, Node) else v
+                                 for v in (getattr(expr, f.name) for f in fields(expr) if f.init))
+
+def _rename(expr: Expr, old: str, new: str) -> Expr:
+    if isinstance(expr, Name) and expr.name == old:
+        return Name(new)
+    return map_children(expr, lambda child: _rename(child, old, new))
+
+class _Hoisted:
+    """Subtrees lifted out of one Letfun body, each bound once to a temporary."""
+
+    def __init__(self, fresh: Callable[[], str]):
+        self.fresh = fresh
+        self.bindings: List[Tuple[str, Expr]] = []
+        self.names: Dict[tuple, str] = {}
+
+    def bind(self, expr: Expr, name: str = None) -> str:
+        """Name of the temporary holding `expr`, reusing one bound to an equal subtree."""
+        key = _shape(expr)
+        existing = self.names.get(key)
+        if existing is not None:
+            return existing
+        name = name or self.fresh()
+        self.names[key] = name
+        self.bindings.append((name, expr))
+        return name
+
+def _hoist_from(expr: Expr, tenv: TyEnv, hoisted: _Hoisted) -> Tuple[Expr, Ty]:
+    """Replace maximal safe subtrees of a function body with temporaries.
+
+    Returns the rewritten expression and its safe type; a safe result is left
+    for the caller to hoist so that only maximal subtrees are lifted.
+    """
+    match expr:
+        case Let(name, value_expr, body) if name.startswith(_TEMP_PREFIX):
+            # A temporary bound by an inner Letfun: move its binding out too,
+            # rather than leaving an alias of a new temporary behind.
+            value, value_ty = _hoist_from(value_expr, tenv, hoisted)
+            if value_ty is not Ty.ANY:
+                kept = hoisted.bind(value, name)
+                if kept != name:
+                    body = _rename(body, name, kept)
+                return _hoist_child(body, tenv, hoisted), Ty.ANY
+            value = _lift(value, hoisted, value_ty)
+            return _rebuild(expr, {'value_expr': value, 'body': _hoist_child(body, tenv, hoisted)}), Ty.ANY
+
+        case Let(name, value_expr, body):
+            value = _hoist_child(value_expr, tenv, hoisted)
+            body = _hoist_child(body, {k: v for k, v in tenv.items() if k != name}, hoisted)
+            return _rebuild(expr, {'value_expr': value, 'body': body}), Ty.ANY
+
+        case Letfun(name, param, body, in_expr):
+            fun_body = _hoist_child(body, {k: v for k, v in tenv.items() if k not in (name, param)}, hoisted)
+            in_ = _hoist_child(in_expr, {k: v for k, v in tenv.items() if k != name}, hoisted)
+            return _rebuild(expr, {'body': fun_body, 'in_expr': in_}), Ty.ANY
+
+    results = []
+    def visit(child: Expr) -> Expr:
+        results.append(_hoist_from(child, tenv, hoisted))
+        return results[-1][0]
+    rebuilt = map_children(expr, visit)
+    # A node with an opaque operand is never safe; its tys would also be short.
+    ty = Ty.ANY if _has_opaque_operand(expr) else _safe_type(expr, [t for _, t in results], tenv)
+    if ty is not Ty.ANY:
+        return rebuilt, ty
+    # map_children visits the same children in the same order, so the
+    # results line up with them positionally.
+    child_tys = iter([t for _, t in results])
+    return map_children(rebuilt, lambda child: _lift(child, hoisted, next(child_tys))), Ty.ANY
+
+def _lift(expr: Expr, hoisted: _Hoisted, ty: Ty) -> Expr:
+    if ty is Ty.ANY or isinstance(expr, (Lit, Name)):
+        return expr
+    return Name(hoisted.bind(expr))
+
+def _hoist_child(expr: Expr, tenv: TyEnv, hoisted: _Hoisted) -> Expr:
+    new, ty = _hoist_from(expr, tenv, hoisted)
+    return _lift(new, hoisted, ty)
+
+def _hoist(expr: Expr, tenv: TyEnv, assigned: Set[str], fresh: Callable[[], str]) -> Expr:
+    match expr:
+        case Let(name, value_expr, body):
+            value = _hoist(value_expr, tenv, assigned, fresh)
+            value_ty = Ty.ANY if name in assigned else _specialize(value, tenv, assigned)[1]
+            body = _hoist(body, {**tenv, name: value_ty}, assigned, fresh)
+            return _rebuild(expr, {'value_expr': value, 'body': body})
+
+        case Letfun(name, param, body, in_expr):
+            inner = {k: v for k, v in tenv.items() if k not in (name, param)}
+            hoisted = _Hoisted(fresh)
+            fun_body = _hoist_child(_hoist(body, inner, assigned, fresh), inner, hoisted)
+            in_ = _hoist(in_expr, {k: v for k, v in tenv.items() if k != name}, assigned, fresh)
+            result = _rebuild(expr, {'body': fun_body, 'in_expr': in_})
+            for tmp, sub in reversed(hoisted.bindings):
+                result = Let(tmp, sub, result)
+            return result
+
+        case _:
+            return map_children(expr, lambda child: _hoist(child, tenv, assigned, fresh))
+
+def hoist_invariants(expr: Expr) -> Expr:
+    """Evaluate argument-independent parts of each Letfun body once, in a Let around the Letfun.
+
+    Only subtrees that cannot raise or have side effects and that read
+    nothing but never-assigned outer Let bindings are moved, so the program's
+    result and output are unchanged.
+    """
+    counter = count()
+    return _hoist(expr, {}, assigned_names(expr), lambda: f"{_TEMP_PREFIX}{next(counter)}")
+
+def optimize(expr: Expr) -> Expr:
+    return specialize(hoist_invariants(fold(expr)))
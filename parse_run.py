@@ -1,6 +1,10 @@
 from lark import Lark, Transformer
 from pathlib import Path
+import sys
+from typing import Dict
 from interp import *  
+from optimize import optimize
+from vm import execute
 
 parser = Lark(
     Path('expr.lark').read_text(),
@@ -13,29 +17,39 @@ parser = Lark(
     cache=False
 )
 
+# Lit is immutable, so every occurrence of a common integer shares one node.
+_SMALL_INT_LITS: Dict[int, Lit] = {i: Lit(i) for i in range(-5, 257)}
+
 class ExprTransformer(Transformer):
     def number(self, n):
-        return Lit(int(n[0]))
+        value = int(n[0])
+        lit = _SMALL_INT_LITS.get(value)
+        return lit if lit is not None else Lit(value)
 
     def string(self, s):
         return Lit(s[0][1:-1])  # Remove quotes
 
+    # Identifiers are interned so environment lookups compare keys by identity.
     def name(self, n):
-        return Name(str(n[0]))
+        return Name(sys.intern(str(n[0])))
 
     def assign(self, args):
-        return Assign(args[0], args[1])
+        return Assign(sys.intern(str(args[0])), args[1])
 
     def seq(self, args):
+        # `a; b; c` nests as Seq(a, Seq(b, c)); flatten into one Block.
         if len(args) == 2:
-            return Seq(args[0], args[1])
+            exprs = []
+            for e in args:
+                exprs.extend(e.exprs if isinstance(e, Block) else (e,))
+            return Block(tuple(exprs))
         return args[0]  
 
     def letfun(self, args):
-        return Letfun(name=str(args[0]), param=str(args[1]), body=args[2], in_expr=args[3])
+        return Letfun(name=sys.intern(str(args[0])), param=sys.intern(str(args[1])), body=args[2], in_expr=args[3])
 
     def let(self, args):
-        return Let(name=str(args[0]), value_expr=args[1], body=args[2])
+        return Let(name=sys.intern(str(args[0])), value_expr=args[1], body=args[2])
 
     def app(self, args):
         return App(args[0], args[1])
@@ -112,16 +126,30 @@ class ExprTransformer(Transformer):
     def not_not(self, args):
         return Not(Not(args[0]))
 
-def just_parse(expr_str):
-    tree = parser.parse(expr_str)
-    return ExprTransformer().transform(tree)
+_TRANSFORMER = ExprTransformer()
 
-def parse_and_run(expr_str):
-    tree = parser.parse(expr_str)
-    print(tree.pretty())  
-    ast = ExprTransformer().transform(tree)
+# Source text -> AST, so repeated sources skip the Earley parse entirely.
+_AST_CACHE = {}
+
+def just_parse(expr_str):
+    ast = _AST_CACHE.get(expr_str)
+    if ast is None:
+        ast = optimize(_TRANSFORMER.transform(parser.parse(expr_str)))
+        _AST_CACHE[expr_str] = ast
+    return ast
+
+# engine="vm" runs the program on the bytecode VM instead of the tree walker.
+_ENGINES = {"eval": eval, "vm": execute}
+
+def parse_and_run(expr_str, verbose=False, engine="eval"):
+    run = _ENGINES.get(engine)
+    if run is None:
+        raise ValueError(f"Unknown engine: {engine}")
+    if verbose:
+        print(parser.parse(expr_str).pretty())
+    ast = just_parse(expr_str)
     print("AST:", ast)
-    result = eval(ast)
+    result = run(ast)
     print("Result:", result)
 
 if __name__ == "__main__":
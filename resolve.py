@@ -0,0 +1,136 @@
+# Lexical resolution pass for the bytecode compiler.
+# 1. Every Name/Let/Assign/Letfun is rewritten to a slot node, so variables are frame indices, not dict keys.
+# 2. Functions become flat closures: each FunSlot lists the enclosing cells it captures.
+
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+from interp import *
+
+# How a NameSlot/AssignSlot reaches its variable.
+LOCAL = 0  # plain value in the current frame
+CELL = 1   # Cell in the current frame, shared with inner closures
+FREE = 2   # Cell captured by the current closure
+
+@dataclass(slots=True, frozen=True)
+class NameSlot(Node):
+    idx: int
+    kind: int
+
+@dataclass(slots=True, frozen=True)
+class LetSlot(Node):
+    idx: int
+    cell: bool
+    value_expr: 'Expr'
+    body: 'Expr'
+
+@dataclass(slots=True, frozen=True)
+class AssignSlot(Node):
+    idx: int
+    kind: int
+    value_expr: 'Expr'
+
+@dataclass(slots=True, frozen=True)
+class FunSlot(Node):
+    param_cell: bool
+    body: 'Expr'
+    nlocals: int
+    free: Tuple[Tuple[int, int], ...]  # (CELL or FREE, idx) in the enclosing function
+
+@dataclass(slots=True, frozen=True)
+class LetfunSlot(Node):
+    idx: int
+    cell: bool
+    fun: FunSlot
+    in_expr: 'Expr'
+
+class _Binding:
+    __slots__ = ('level', 'slot', 'captured')
+
+    def __init__(self, level: int, captured: bool):
+        self.level = level
+        self.slot = -1
+        self.captured = captured
+
+class _Fun:
+    def __init__(self, level: int, parent: Optional['_Fun']):
+        self.level = level
+        self.parent = parent
+        self.nlocals = 1  # slot 0 holds the parameter
+        self.free: List[Tuple[int, int]] = []
+        self.free_index: Dict[_Binding, int] = {}
+
+    def new_slot(self) -> int:
+        self.nlocals += 1
+        return self.nlocals - 1
+
+    def access(self, b: _Binding) -> Tuple[int, int]:
+        if b.level == self.level:
+            return (CELL if b.captured else LOCAL), b.slot
+        idx = self.free_index.get(b)
+        if idx is None:
+            idx = len(self.free)
+            self.free.append(self.parent.access(b))
+            self.free_index[b] = idx
+        return FREE, idx
+
+def _captured(name: str, expr: Expr, in_fun: bool = False) -> bool:
+    """Whether a free occurrence of `name` in `expr` lies inside a Letfun body.
+
+    Computed per binder occurrence rather than per node, since frozen nodes
+    may be shared between places in the tree.
+    """
+    match expr:
+        case Name(n):
+            return in_fun and n == name
+        case Assign(n, value_expr):
+            return (in_fun and n == name) or _captured(name, value_expr, in_fun)
+        case Let(n, value_expr, body):
+            return _captured(name, value_expr, in_fun) or (n != name and _captured(name, body, in_fun))
+        case Letfun(n, param, body, in_expr):
+            if n == name:
+                return False
+            return (param != name and _captured(name, body, True)) or _captured(name, in_expr, in_fun)
+        case _:
+            return any(_captured(name, child, in_fun) for child in children(expr))
+
+def _rewrite(expr: Expr, scope: Dict[str, _Binding], fun: _Fun) -> Expr:
+    match expr:
+        case Name(name):
+            b = scope.get(name)
+            if b is None:
+                return expr  # compiled to a runtime NameError
+            kind, idx = fun.access(b)
+            return NameSlot(idx, kind)
+
+        case Assign(name, value_expr):
+            b = scope.get(name)
+            if b is None:
+                return expr
+            kind, idx = fun.access(b)
+            return AssignSlot(idx, kind, _rewrite(value_expr, scope, fun))
+
+        case Let(name, value_expr, body):
+            value = _rewrite(value_expr, scope, fun)
+            b = _Binding(fun.level, _captured(name, body))
+            b.slot = fun.new_slot()
+            return LetSlot(b.slot, b.captured, value, _rewrite(body, {**scope, name: b}, fun))
+
+        case Letfun(name, param, body, in_expr):
+            # The function's own name is captured by any recursive call in its body.
+            b = _Binding(fun.level, (param != name and _captured(name, body, True)) or _captured(name, in_expr))
+            pb = _Binding(fun.level + 1, _captured(param, body))
+            b.slot = fun.new_slot()
+            pb.slot = 0
+            inner = _Fun(fun.level + 1, fun)
+            fun_body = _rewrite(body, {**scope, name: b, param: pb}, inner)
+            fn = FunSlot(pb.captured, fun_body, inner.nlocals, tuple(inner.free))
+            return LetfunSlot(b.slot, b.captured, fn, _rewrite(in_expr, {**scope, name: b}, fun))
+
+        case _:
+            return map_children(expr, lambda child: _rewrite(child, scope, fun))
+
+def resolve(expr: Expr) -> FunSlot:
+    """Resolve `expr` as the body of a parameterless top-level function."""
+    top = _Fun(0, None)
+    body = _rewrite(expr, {}, top)
+    return FunSlot(False, body, top.nlocals, ())
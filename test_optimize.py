@@ -0,0 +1,54 @@
+import unittest
+
+from interp import *
+from optimize import optimize
+from parse_run import _TRANSFORMER, parser
+from test_vm import ASTS, SOURCES, outcome
+
+
+class OptimizePreservesMeaningTest(unittest.TestCase):
+    def assertSameMeaning(self, expr):
+        self.assertEqual(outcome(eval, expr), outcome(eval, optimize(expr)), expr)
+
+    def test_parsed_programs(self):
+        for src in SOURCES:
+            with self.subTest(src=src):
+                self.assertSameMeaning(_TRANSFORMER.transform(parser.parse(src)))
+
+    def test_ast_programs(self):
+        for expr in ASTS:
+            with self.subTest(expr=expr):
+                self.assertSameMeaning(expr)
+
+
+class OptimizeRewritesTest(unittest.TestCase):
+    def test_folds_literal_operators(self):
+        self.assertEqual(optimize(Concat(Lit("a"), Lit("b"))), Lit("ab"))
+
+    def test_keeps_raising_operators(self):
+        self.assertEqual(optimize(Div(Lit(1), Lit(0))), Div(Lit(1), Lit(0)))
+
+    def test_drops_dead_branch(self):
+        self.assertEqual(optimize(If(Lit(True), Show(Lit(1)), Read())), Show(Lit(1)))
+        self.assertEqual(optimize(If(Lit(0), Show(Lit(1)), Read())), Read())
+
+    def test_double_negation(self):
+        cond = Lt(Name("a"), Lit(2))
+        self.assertEqual(optimize(Let("a", Lit(1), Not(Not(cond)))).body, cond)
+        # !!x coerces to bool, so it only cancels out when x is already one.
+        self.assertEqual(optimize(Let("a", Lit(5), Not(Not(Name("a"))))).body, Not(Not(Name("a"))))
+        self.assertIs(optimize(Not(Not(Lit(5)))).value, True)
+
+    def test_replace_with_literal_operands(self):
+        expr = optimize(Let("s", Lit("banana"), Replace(Name("s"), Lit("an"), Lit("AN"))))
+        self.assertEqual(expr.body, ReplaceLit(Name("s"), "an", "AN"))
+
+    def test_hoists_invariant_subexpression(self):
+        square = Mul(Name("n"), Name("n"))
+        expr = optimize(Let("n", Lit(3), Letfun("f", "x", Add(square, Name("x")), App(Name("f"), Lit(1)))))
+        self.assertEqual(expr.body, Let("%inv0", square, Letfun("f", "x", Add(Name("%inv0"), Name("x")),
+                                                                 App(Name("f"), Lit(1)))))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+import contextlib
+import io
+import unittest
+
+from interp import *
+from optimize import optimize
+from parse_run import just_parse
+from vm import execute
+
+
+def outcome(run, expr):
+    """(result or exception type and message, printed output) of running expr."""
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+        try:
+            result = ('ok', run(expr))
+        except Exception as e:
+            result = ('error', type(e).__name__, str(e))
+    return result, out.getvalue()
+
+
+SOURCES = [
+    '1 + 2 * 3',
+    '"hello" ++ " world"',
+    'let x = 5 in x * x end',
+    'letfun f(x) = x * 2 in f(21) end',
+    'letfun fact(n) = if n < 1 then 1 else n * fact(n - 1) in fact(10) end',
+    'letfun loop(n) = if n < 1 then 0 else loop(n - 1) in loop(5000) end',
+    'let a = 1 in (a := a + 1); a end',
+    'let n = 3 in letfun f(x) = letfun g(y) = n * n + x in g(1) end in f(3) end end',
+    'if 1 < 2 then "yes" else "no"',
+    'true && false || true',
+    '7 / 0',
+    'x + 1',
+    'true || length("ab") == 2',
+    'let n = 2 in if n < 3 then 1 else length("ab") end',
+    '1; length("ab")',
+    'let n = 2 in letfun f(x) = if n < 1 then 1 else length("a") in f(1) end end',
+]
+
+SHARED = Let("a", Lit(5), Name("a"))
+
+ASTS = [
+    # The divisor is checked before the dividend is evaluated.
+    Div(Show(Lit(1)), Lit(0)),
+    Div(Lit("s"), Lit(0)),
+    Div(Lit("s"), Lit(2)),
+    # The callee is checked before the argument is evaluated.
+    App(Lit(3), Show(Lit("arg"))),
+    Letfun("f", "x", App(Name("x"), Show(Lit("arg"))), App(Name("f"), Lit(4))),
+    # Closures share the cell of a variable assigned after they are built.
+    Let("n", Lit(1),
+        Letfun("get", "u", Name("n"),
+               Seq(Assign("n", Lit(2)), App(Name("get"), Lit(0))))),
+    And(Lit(1), Show(Lit("rhs"))),
+    Or(Lit(True), Show(Lit("rhs"))),
+    Concat(Lit("a"), Lit(1)),
+    Replace(Lit("banana"), Lit("an"), Lit("AN")),
+    LengthStr(ReverseStr(Lit("abc"))),
+    # A frozen subtree shared by two places is resolved separately at each.
+    Let("b", Lit(7), Letfun("f", "p", Add(SHARED, Name("b")),
+                            Add(App(Name("f"), Lit(0)), SHARED))),
+    # Unknown nodes, here an unresolved lark `_ambig` Tree, fail only when reached.
+    Or(Lit(True), Eq(just_parse('length("ab")'), Lit(2))),
+    If(Lit(False), just_parse('length("ab")'), Lit(0)),
+    just_parse('length("ab")'),
+]
+
+
+class EngineAgreementTest(unittest.TestCase):
+    def assertSameOutcome(self, expr):
+        self.assertEqual(outcome(eval, expr), outcome(execute, expr), expr)
+
+    def test_parsed_programs(self):
+        for src in SOURCES:
+            with self.subTest(src=src):
+                self.assertSameOutcome(just_parse(src))
+
+    def test_ast_programs(self):
+        for expr in ASTS:
+            with self.subTest(expr=expr):
+                self.assertSameOutcome(expr)
+                self.assertSameOutcome(optimize(expr))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,455 @@
+# Bytecode compiler and stack VM for the expression language.
+# 1. compile() flattens an AST into an array of small-int opcodes with inline operands.
+# 2. Names are resolved to frame slots by resolve.resolve(), so run() never does a dict lookup.
+# 3. Calls in tail position compile to TAIL_CALL, which does not push a return address,
+#    so tail recursion runs in constant space.
+
+from array import array
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+from interp import *
+from resolve import *
+
+# Opcodes, roughly ordered by how often they execute.
+LOAD_LOCAL = 0
+LOAD_CONST = 1
+ADD = 2
+SUB = 3
+MUL = 4
+DIV = 5
+LT = 6
+EQ = 7
+JUMP_IF_FALSE = 8
+JUMP = 9
+CALL = 10
+RET = 11
+STORE_LOCAL = 12
+LOAD_CELL = 13
+LOAD_FREE = 14
+STORE_CELL = 15
+STORE_FREE = 16
+MAKE_CELL = 17
+DUP = 18
+POP = 19
+NEG = 20
+NOT = 21
+CHECK_AND = 22
+CHECK_OR = 23
+CONCAT = 24
+REPLACE = 25
+REVERSE = 26
+LENGTH = 27
+MAKE_CLOSURE = 28
+SHOW = 29
+READ = 30
+RAISE_NAME = 31
+HALT = 32
+JUMP_IF_FALSE_OR_POP = 33
+JUMP_IF_TRUE_OR_POP = 34
+REPLACE_LIT = 35
+TAIL_CALL = 36
+CHECK_DIVISOR = 37
+CHECK_CALLABLE = 38
+RAISE_TYPE = 39
+
+_LOAD = {LOCAL: LOAD_LOCAL, CELL: LOAD_CELL, FREE: LOAD_FREE}
+_STORE = {LOCAL: STORE_LOCAL, CELL: STORE_CELL, FREE: STORE_FREE}
+
+class Cell:
+    __slots__ = ('value',)
+
+    def __init__(self, value: Any = None):
+        self.value = value
+
+@dataclass(slots=True)
+class FunProto:
+    fun: FunSlot
+    entry: int = 0
+
+@dataclass(slots=True)
+class Closure:
+    proto: FunProto
+    cells: List[Cell]
+
+class _Compiler:
+    def __init__(self):
+        self.code = array('i')
+        self.consts: List[Any] = []
+        self.const_index: Dict[Tuple[type, Any], int] = {}
+        self.pending: List[FunProto] = []
+
+    def const(self, value) -> int:
+        key = (type(value), value) if isinstance(value, (int, str)) else (type(value), id(value))
+        idx = self.const_index.get(key)
+        if idx is None:
+            idx = len(self.consts)
+            self.consts.append(value)
+            self.const_index[key] = idx
+        return idx
+
+    def emit(self, *ints: int) -> int:
+        self.code.extend(ints)
+        return len(self.code) - 1
+
+    def patch(self, at: int, target: int):
+        self.code[at] = target
+
+    def bind(self, idx: int, cell: bool):
+        if cell:
+            self.emit(MAKE_CELL, idx)
+            self.emit(STORE_CELL, idx)
+        else:
+            self.emit(STORE_LOCAL, idx)
+
+    def expr(self, expr: Expr, tail: bool = False):
+        # tail is set when expr's value is returned straight from the enclosing
+        # function, i.e. a RET would follow it.
+        match expr:
+            case Lit(value):
+                self.emit(LOAD_CONST, self.const(value))
+
+            case NameSlot(idx, kind):
+                self.emit(_LOAD[kind], idx)
+
+            case Name(name):
+                self.emit(RAISE_NAME, self.const(f"Undefined variable: {name}"))
+
+            case LetSlot(idx, cell, value_expr, body):
+                self.expr(value_expr)
+                self.bind(idx, cell)
+                self.expr(body, tail)
+
+            case Add(left, right):
+                self.binop(ADD, left, right)
+
+            case Sub(left, right):
+                self.binop(SUB, left, right)
+
+            case Mul(left, right):
+                self.binop(MUL, left, right)
+
+            case Div(left, right):
+                # As in interp.eval, the divisor is evaluated and checked for
+                # zero before the dividend is evaluated at all.
+                self.expr(right)
+                self.emit(CHECK_DIVISOR)
+                self.expr(left)
+                self.emit(DIV)
+
+            case Neg(expr):
+                self.expr(expr)
+                self.emit(NEG)
+
+            case And(left, right):
+                self.short_circuit(JUMP_IF_FALSE_OR_POP, left, right, CHECK_AND)
+
+            case Or(left, right):
+                self.short_circuit(JUMP_IF_TRUE_OR_POP, left, right, CHECK_OR)
+
+            case Not(expr):
+                self.expr(expr)
+                self.emit(NOT)
+
+            case Eq(left, right):
+                self.binop(EQ, left, right)
+
+            case Lt(left, right):
+                self.binop(LT, left, right)
+
+            case If(cond, then, else_):
+                self.expr(cond)
+                to_else = self.emit(JUMP_IF_FALSE, 0)
+                self.expr(then, tail)
+                to_end = self.emit(JUMP, 0)
+                self.patch(to_else, len(self.code))
+                self.expr(else_, tail)
+                self.patch(to_end, len(self.code))
+
+            case Concat(left, right):
+                self.binop(CONCAT, left, right)
+
+            case AndBool(left, right):
+                self.short_circuit(JUMP_IF_FALSE_OR_POP, left, right)
+
+            case OrBool(left, right):
+                self.short_circuit(JUMP_IF_TRUE_OR_POP, left, right)
+
+            case ConcatStr(left, right):
+                self.binop(ADD, left, right)
+
+            case Replace(string, target, replacement):
+                self.expr(string)
+                self.expr(target)
+                self.expr(replacement)
+                self.emit(REPLACE)
+
+            case ReplaceLit(string, target, replacement):
+                self.expr(string)
+                self.emit(REPLACE_LIT, self.const(target), self.const(replacement))
+
+            case ReverseStr(string_expr):
+                self.expr(string_expr)
+                self.emit(REVERSE)
+
+            case LengthStr(string_expr):
+                self.expr(string_expr)
+                self.emit(LENGTH)
+
+            case LetfunSlot(idx, cell, fun, in_expr):
+                proto = FunProto(fun)
+                self.pending.append(proto)
+                if cell:
+                    # A recursive function captures its own, still empty, cell.
+                    self.emit(MAKE_CELL, idx)
+                    self.emit(MAKE_CLOSURE, self.const(proto))
+                    self.emit(STORE_CELL, idx)
+                else:
+                    self.emit(MAKE_CLOSURE, self.const(proto))
+                    self.emit(STORE_LOCAL, idx)
+                self.expr(in_expr, tail)
+
+            case App(fun_expr, arg_expr):
+                # The callee is checked before the argument is evaluated, as in interp.eval.
+                self.expr(fun_expr)
+                self.emit(CHECK_CALLABLE)
+                self.expr(arg_expr)
+                self.emit(TAIL_CALL if tail else CALL)
+
+            case AssignSlot(idx, kind, value_expr):
+                self.expr(value_expr)
+                self.emit(DUP)
+                self.emit(_STORE[kind], idx)
+
+            case Assign(name, _):
+                self.emit(RAISE_NAME, self.const(f"Variable '{name}' is not defined"))
+
+            case Seq(first, second):
+                self.expr(first)
+                self.emit(POP)
+                self.expr(second, tail)
+
+            case Block(exprs):
+                for e in exprs[:-1]:
+                    self.expr(e)
+                    self.emit(POP)
+                self.expr(exprs[-1], tail)
+
+            case Show(expr):
+                self.expr(expr)
+                self.emit(SHOW)
+
+            case Read():
+                self.emit(READ)
+
+            case _:
+                # Like eval, fail only if the node is actually reached, e.g. an
+                # unresolved lark `_ambig` Tree in a branch that never runs.
+                self.emit(RAISE_TYPE, self.const(f"Unknown expression type: {expr}"))
+
+    def binop(self, op: int, left: Expr, right: Expr):
+        self.expr(left)
+        self.expr(right)
+        self.emit(op)
+
+    def short_circuit(self, jump: int, left: Expr, right: Expr, check: Optional[int] = None):
+        # The left value is the result when it decides the answer; otherwise it is
+        # popped and the right operand's value is the result.
+        self.expr(left)
+        if check is not None:
+            self.emit(check)
+        to_end = self.emit(jump, 0)
+        self.expr(right)
+        if check is not None:
+            self.emit(check)
+        self.patch(to_end, len(self.code))
+
+def compile(expr: Expr) -> Tuple[array, List[Any], int]:
+    """Compile `expr` to (code, consts, nlocals); nlocals sizes the top-level frame."""
+    c = _Compiler()
+    top = resolve(expr)
+    c.expr(top.body)
+    c.emit(HALT)
+    # Function bodies go after the main program; compiling one may queue more.
+    while c.pending:
+        proto = c.pending.pop()
+        proto.entry = len(c.code)
+        c.expr(proto.fun.body, tail=True)
+        c.emit(RET)
+    return c.code, c.consts, top.nlocals
+
+def run(code: array, consts: List[Any], nlocals: int = 1) -> Any:
+    stack: List[Any] = []
+    push = stack.append
+    pop = stack.pop
+    calls: List[Tuple[int, List[Any], List[Cell]]] = []
+    frame: List[Any] = [None] * nlocals
+    cells: List[Cell] = []
+    ip = 0
+
+    while True:
+        op = code[ip]
+        ip += 1
+        if op == LOAD_LOCAL:
+            push(frame[code[ip]])
+            ip += 1
+        elif op == LOAD_CONST:
+            push(consts[code[ip]])
+            ip += 1
+        elif op == ADD:
+            right = pop()
+            stack[-1] = stack[-1] + right
+        elif op == SUB:
+            right = pop()
+            stack[-1] = stack[-1] - right
+        elif op == MUL:
+            right = pop()
+            stack[-1] = stack[-1] * right
+        elif op == DIV:
+            left = pop()
+            stack[-1] = left // stack[-1]
+        elif op == CHECK_DIVISOR:
+            if stack[-1] == 0:
+                raise ZeroDivisionError("Division by zero")
+        elif op == LT:
+            right = pop()
+            stack[-1] = stack[-1] < right
+        elif op == EQ:
+            right = pop()
+            stack[-1] = stack[-1] == right
+        elif op == JUMP_IF_FALSE:
+            if pop():
+                ip += 1
+            else:
+                ip = code[ip]
+        elif op == JUMP:
+            ip = code[ip]
+        elif op == CALL:
+            arg = pop()
+            func = pop()
+            fun = func.proto.fun
+            calls.append((ip, frame, cells))
+            frame = [None] * fun.nlocals
+            frame[0] = Cell(arg) if fun.param_cell else arg
+            cells = func.cells
+            ip = func.proto.entry
+        elif op == TAIL_CALL:
+            # The callee returns straight to our caller, so our frame is dropped.
+            arg = pop()
+            func = pop()
+            fun = func.proto.fun
+            frame = [None] * fun.nlocals
+            frame[0] = Cell(arg) if fun.param_cell else arg
+            cells = func.cells
+            ip = func.proto.entry
+        elif op == CHECK_CALLABLE:
+            if not isinstance(stack[-1], Closure):
+                raise TypeError(f"'{stack[-1]}' is not a function")
+        elif op == RET:
+            ip, frame, cells = calls.pop()
+        elif op == STORE_LOCAL:
+            frame[code[ip]] = pop()
+            ip += 1
+        elif op == LOAD_CELL:
+            push(frame[code[ip]].value)
+            ip += 1
+        elif op == LOAD_FREE:
+            push(cells[code[ip]].value)
+            ip += 1
+        elif op == STORE_CELL:
+            frame[code[ip]].value = pop()
+            ip += 1
+        elif op == STORE_FREE:
+            cells[code[ip]].value = pop()
+            ip += 1
+        elif op == MAKE_CELL:
+            frame[code[ip]] = Cell()
+            ip += 1
+        elif op == DUP:
+            push(stack[-1])
+        elif op == POP:
+            pop()
+        elif op == NEG:
+            stack[-1] = -stack[-1]
+        elif op == NOT:
+            stack[-1] = not stack[-1]
+        elif op == CHECK_AND:
+            if not isinstance(stack[-1], bool):
+                raise TypeError("Operands of '&&' must be boolean")
+        elif op == CHECK_OR:
+            if not isinstance(stack[-1], bool):
+                raise TypeError("Operands of '||' must be boolean")
+        elif op == JUMP_IF_FALSE_OR_POP:
+            if stack[-1]:
+                pop()
+                ip += 1
+            else:
+                ip = code[ip]
+        elif op == JUMP_IF_TRUE_OR_POP:
+            if stack[-1]:
+                ip = code[ip]
+            else:
+                pop()
+                ip += 1
+        elif op == CONCAT:
+            right = pop()
+            left = stack[-1]
+            if isinstance(left, str) and isinstance(right, str):
+                stack[-1] = left + right
+            else:
+                raise TypeError("Concatenation requires string operands")
+        elif op == REPLACE:
+            replacement = pop()
+            target = pop()
+            str_val = stack[-1]
+            if isinstance(str_val, str) and isinstance(target, str) and isinstance(replacement, str):
+                stack[-1] = str_val.replace(target, replacement)
+            else:
+                raise TypeError("Replace requires string operands")
+        elif op == REPLACE_LIT:
+            if not isinstance(stack[-1], str):
+                raise TypeError("Replace requires string operands")
+            stack[-1] = stack[-1].replace(consts[code[ip]], consts[code[ip + 1]])
+            ip += 2
+        elif op == REVERSE:
+            if not isinstance(stack[-1], str):
+                raise TypeError("Reverse requires a string operand")
+            stack[-1] = stack[-1][::-1]
+        elif op == LENGTH:
+            if not isinstance(stack[-1], str):
+                raise TypeError("Length requires a string operand")
+            stack[-1] = len(stack[-1])
+        elif op == MAKE_CLOSURE:
+            proto = consts[code[ip]]
+            push(Closure(proto, [frame[i] if kind == CELL else cells[i] for kind, i in proto.fun.free]))
+            ip += 1
+        elif op == SHOW:
+            print(stack[-1])
+        elif op == READ:
+            user_input = input().strip()
+            try:
+                push(int(user_input))
+            except ValueError:
+                raise ValueError("Invalid input, expected an integer")
+        elif op == RAISE_NAME:
+            raise NameError(consts[code[ip]])
+        elif op == RAISE_TYPE:
+            raise TypeError(consts[code[ip]])
+        elif op == HALT:
+            return stack[-1]
+        else:
+            raise TypeError(f"Unknown opcode: {op}")
+
+def execute(expr: Expr) -> Any:
+    return run(*compile(expr))
+
+if __name__ == "__main__":
+    print(execute(Concat(Lit("hello"), Lit(" world"))))  # Expected: "hello world"
+    print(execute(Replace(Lit("hello world"), Lit("world"), Lit("Python"))))  # Expected: "hello Python"
+
+    fun_expr = Letfun(
+        name="addOne",
+        param="x",
+        body=Add(Name("x"), Lit(1)),
+        in_expr=App(Name("addOne"), Lit(41))
+    )
+    print(execute(fun_expr))  # Expected: 42